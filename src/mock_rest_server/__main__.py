@@ -1,11 +1,15 @@
 """mock_rest_server"""
 
-from http.server import HTTPServer
+from http.server import HTTPServer, ThreadingHTTPServer
+from socketserver import ThreadingMixIn
+from concurrent.futures import ThreadPoolExecutor
 from argparse import ArgumentParser
 from threading import Thread
 from time import sleep
 from pathlib import Path
 from ssl import SSLContext, PROTOCOL_TLS_SERVER
+import logging
+import socket
 import subprocess
 
 from mock_rest_server.database import JsonDatabase
@@ -21,6 +25,50 @@ keyUsage=digitalSignature
 extendedKeyUsage=serverAuth"""
 
 
+class ReusePortHTTPServer(HTTPServer):
+    """An HTTP server whose port may be shared by several processes"""
+
+    def server_bind(self):
+        if hasattr(socket, "SO_REUSEPORT"):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+class ReusePortThreadingHTTPServer(ThreadingMixIn, ReusePortHTTPServer):
+    """A threaded HTTP server whose port may be shared by several processes"""
+
+    daemon_threads = True
+
+
+class ThreadPoolMixIn(ThreadingMixIn):
+    """Mix-in class to handle connections on a bounded pool of worker threads,
+    rather than starting a new thread for each connection"""
+
+    max_threads = 32
+    _pool: ThreadPoolExecutor | None = None
+
+    def process_request(self, request, client_address):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(
+                self.max_threads, thread_name_prefix="HTTPRequestWorker"
+            )
+        self._pool.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        if self._pool is not None:
+            self._pool.shutdown(wait=self.block_on_close)
+
+
+class ThreadPoolHTTPServer(ThreadPoolMixIn, HTTPServer):
+    """An HTTP server handling connections on a bounded pool of threads"""
+
+
+class ReusePortThreadPoolHTTPServer(ThreadPoolMixIn, ReusePortHTTPServer):
+    """An HTTP server handling connections on a bounded pool of threads,
+    whose port may be shared by several processes"""
+
+
 def _generate_localhost_cert_args(cert_path: Path, key_path: Path, cn: str):
     config_path = Path(f"tmp_mock.ssl.{cn}.conf").resolve()
     with config_path.open("w+", encoding="utf-8") as config_file:
@@ -54,15 +102,46 @@ def main() -> None:
         "--port", "-p", type=int, help="Listening port for HTTP Server", default=8080
     )
     parser.add_argument("--address", "-ip", help="HTTP Server IP", default="0.0.0.0")
+    parser.add_argument(
+        "--single-threaded",
+        action="store_true",
+        help="handle one request at a time, skipping locks on the request path.",
+    )
+    parser.add_argument(
+        "--max-threads",
+        type=int,
+        help="handle connections on a pool of at most this many threads, "
+        "instead of a new thread per connection.",
+    )
+    parser.add_argument(
+        "--reuse-port",
+        action="store_true",
+        help="allow other processes to listen on the same port (SO_REUSEPORT).",
+    )
     parser.add_argument("--dbfile", "-db", type=Path, default="mock-rest.db.json")
     parser.add_argument(
         "--db-id-field", default="id", help="record field to use for record ID lookups."
     )
     parser.add_argument(
         "--db-min-persist-period",
+        type=float,
         default=30,
         help="number of seconds to wait between persisting updated database contents.",
     )
+    parser.add_argument(
+        "--db-index",
+        nargs=2,
+        action="append",
+        default=[],
+        metavar=("RESOURCE", "FIELD"),
+        help="index a resource field for fast exact-match queries. repeatable.",
+    )
+    parser.add_argument(
+        "--log-level",
+        default="INFO",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        help="minimum level of log messages to show. INFO includes each request.",
+    )
     parser.add_argument("--secure", "-s", action="store_true")
     parser.add_argument(
         "--ssl-keyfile", "-key", type=Path, default=Path("localhost.key")
@@ -73,10 +152,22 @@ def main() -> None:
     parser.add_argument("--ssl-generate", "-gen", action="store_true")
     parser.add_argument("--ssl-cn", "-cn", default="localhost")
     args = parser.parse_args()
+    logging.basicConfig(
+        level=args.log_level, format="[%(asctime)s] %(levelname)s %(name)s: %(message)s"
+    )
     db_file: Path = args.dbfile.resolve()
 
-    database = JsonDatabase(db_file, args.db_id_field, args.db_min_persist_period)
-    JsonHttpRequestHandler.configure(database=database)
+    database = JsonDatabase(
+        db_file,
+        args.db_id_field,
+        args.db_min_persist_period,
+        threaded=not args.single_threaded,
+    )
+    for resource, field in args.db_index:
+        database.register_index(resource, field)
+    JsonHttpRequestHandler.configure(
+        database=database, keep_alive=not args.single_threaded
+    )
     protocol, hostname, server = configure_server(args, JsonHttpRequestHandler)
 
     print(f"Serving Mock REST database server from {args.dbfile}")
@@ -106,7 +197,19 @@ def configure_server(args, handler: type):
     """Configure the HTTP server for runtime"""
     protocol = "http"
     hostname = args.address if args.address != "0.0.0.0" else "localhost"
-    server = HTTPServer((args.address, args.port), handler)
+    if args.single_threaded:
+        server_type = ReusePortHTTPServer if args.reuse_port else HTTPServer
+    elif args.max_threads:
+        server_type = (
+            ReusePortThreadPoolHTTPServer if args.reuse_port else ThreadPoolHTTPServer
+        )
+    else:
+        server_type = (
+            ReusePortThreadingHTTPServer if args.reuse_port else ThreadingHTTPServer
+        )
+    server = server_type((args.address, args.port), handler)
+    if args.max_threads:
+        server.max_threads = args.max_threads
     if args.secure:
         protocol = "https"
         hostname = enable_https(args, server)
@@ -1,74 +1,125 @@
 """Assistive dynamic filters for dealing with the resource record list queries"""
 from typing import Any
+from functools import lru_cache
 from logging import getLogger
+import re
 
 LOGGER = getLogger(__name__)
 
+# number of filters kept for reuse by later queries, per entry point
+FILTER_CACHE_SIZE = 1024
 
-def _record_param_equals_value(param: str, search: str):
+
+def _record_param_equals_value(param: str, search_cf: str):
     """Generates a curried search filter for whether
-    a parameter on a record contains a search string"""
-    LOGGER.info("Building filter for [%s] = `%s`", param, search)
+    a parameter on a record equals a casefolded search string"""
+    LOGGER.debug("Building filter for [%s] = `%s`", param, search_cf)
 
     def _record_filter(rec: dict[str, Any]):
-        return param in rec and search.casefold() == str(rec[param]).casefold()
+        val = rec.get(param)
+        return val is not None and search_cf == str(val).casefold()
 
     return _record_filter
 
 
-def _record_param_contains_value(param: str, search: str):
+def _record_param_contains_value(param: str, search_cf: str):
     """Generates a curried search filter for whether
-    a parameter on a record contains a search string"""
-    LOGGER.info("Building filter for [%s] contains `%s`", param, search)
+    a parameter on a record contains a casefolded search string"""
+    LOGGER.debug("Building filter for [%s] contains `%s`", param, search_cf)
 
     def _record_filter(rec: dict[str, Any]):
-        return param in rec and search.casefold() in str(rec[param]).casefold()
+        val = rec.get(param)
+        return val is not None and search_cf in str(val).casefold()
 
     return _record_filter
 
 
-def _record_param_startswith_value(param: str, search: str):
+def _record_param_startswith_value(param: str, search_cf: str):
     """Generates a curried search filter for whether
-    a parameter on a record starts with a search string"""
-    LOGGER.info("Building filter for [%s] starts with `%s`", param, search)
+    a parameter on a record starts with a casefolded search string"""
+    LOGGER.debug("Building filter for [%s] starts with `%s`", param, search_cf)
 
     def _record_filter(rec: dict[str, Any]):
-        return (
-            param in rec
-            and rec[param]
-            and str(rec[param]).casefold().startswith(search.casefold())
-        )
+        val = rec.get(param)
+        return bool(val) and str(val).casefold().startswith(search_cf)
 
     return _record_filter
 
 
-def _record_param_endswith_value(param: str, search: str):
+def _record_param_endswith_value(param: str, search_cf: str):
     """Generates a curried search filter for whether
-    a parameter on a record ends with a search string"""
-    LOGGER.info("Building filter for [%s] ends with `%s`", param, search)
+    a parameter on a record ends with a casefolded search string"""
+    LOGGER.debug("Building filter for [%s] ends with `%s`", param, search_cf)
 
     def _record_filter(rec: dict[str, Any]):
-        return (
-            param in rec
-            and rec[param]
-            and str(rec[param]).casefold().endswith(search.casefold())
-        )
+        val = rec.get(param)
+        return bool(val) and str(val).casefold().endswith(search_cf)
 
     return _record_filter
 
 
+def has_wild_card(value: str, wild_card: str):
+    """Whether a query value is a wild card search, rather than an exact match"""
+    return value.startswith(wild_card) or value.endswith(wild_card)
+
+
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
 def build_query_filter(param: str, value: str, wild_card: str):
     """Build the appropriate query filter depending on
-    the presence and position of a wild card in the value"""
+    the presence and position of a wild card in the value.
+
+    Filters are cached by parameter and query value,
+    so repeated queries reuse the same filter functions."""
     if value.startswith(wild_card):
         if value.endswith(wild_card):
             search = value.strip(wild_card)
-            return _record_param_contains_value(param, search)
+            return _record_param_contains_value(param, search.casefold())
         else:
             search = value.lstrip(wild_card)
-            return _record_param_endswith_value(param, search)
+            return _record_param_endswith_value(param, search.casefold())
     elif value.endswith(wild_card):
         search = value.rstrip(wild_card)
-        return _record_param_startswith_value(param, search)
+        return _record_param_startswith_value(param, search.casefold())
+    else:
+        return _record_param_equals_value(param, value.casefold())
+
+
+def _value_condition(value: str, wild_card: str):
+    """Translate a query value into a regular expression lookahead over the
+    casefolded record value, and whether it requires a truthy record value"""
+    if value.startswith(wild_card):
+        if value.endswith(wild_card):
+            return f"(?=.*{re.escape(value.strip(wild_card).casefold())})", False
+        return f"(?=.*{re.escape(value.lstrip(wild_card).casefold())}\\Z)", True
+    elif value.endswith(wild_card):
+        return f"(?={re.escape(value.rstrip(wild_card).casefold())})", True
     else:
-        return _record_param_equals_value(param, value)
+        return f"(?={re.escape(value.casefold())}\\Z)", False
+
+
+def build_field_filter(param: str, values: list[str], wild_card: str):
+    """Build a single query filter requiring a parameter to match every one
+    of several values, so each record value is only stringified and casefolded
+    once, and checked against all of the values by one compiled pattern"""
+    if len(values) == 1:
+        return build_query_filter(param, values[0], wild_card)
+    return _record_param_matches_values(param, tuple(values), wild_card)
+
+
+@lru_cache(maxsize=FILTER_CACHE_SIZE)
+def _record_param_matches_values(param: str, values: tuple[str, ...], wild_card: str):
+    """Generates a search filter for whether a parameter
+    on a record matches all of several query values"""
+    LOGGER.debug("Building filter for [%s] matching all of %s", param, values)
+    conditions = [_value_condition(value, wild_card) for value in values]
+    pattern = re.compile("".join(lookahead for lookahead, _ in conditions), re.DOTALL)
+    requires_value = any(required for _, required in conditions)
+    match = pattern.match
+
+    def _record_filter(rec: dict[str, Any]):
+        val = rec.get(param)
+        if val is None or (requires_value and not val):
+            return False
+        return match(str(val).casefold()) is not None
+
+    return _record_filter
@@ -1,14 +1,20 @@
 """Mock JSON Database implementation"""
 
-import json
 from pathlib import Path
-from collections import defaultdict
-from typing import Any, Optional, Callable, Iterable
-from threading import Lock, Event
-from time import time
+from typing import Any, Optional, Callable, ContextManager, Iterable, Mapping
+from contextlib import nullcontext
+from itertools import count
+from queue import Queue, Empty, Full
+from time import monotonic
+from threading import Condition, Thread
 from logging import getLogger
+from sys import intern
+import os
 import uuid
 
+from . import json_codec
+from .locks import ExclusiveLock, ReadWriteLock
+
 LOGGER = getLogger(__name__)
 
 
@@ -39,23 +45,66 @@ class JsonDatabase(object):
     records: dict[str, dict[str, dict[str, Any]]]
     db_file: Path | None
     id_field: str
-    data_lock: Lock
+    data_lock: ReadWriteLock | ExclusiveLock
 
     def __init__(
         self,
         db_file: Path | None = None,
         id_field: str = "id",
-        persist_period_limit: int = 30,
+        persist_period_limit: float = 30,
+        threaded: bool = True,
     ):
         self.db_file = db_file
-        self.records = defaultdict(dict)
+        # Each resource's record map is copy-on-write: writers publish a new
+        # map rather than changing the current one, and stored records are
+        # never modified, so readers can use a map without holding a lock.
+        self.records = {}
+        # snapshots of the resource names, replaced whenever a resource is added
+        self._resource_set: frozenset[str] = frozenset()
+        self._sorted_resources: tuple[str, ...] = ()
         self.id_field = id_field
         self.persist_period_limit = persist_period_limit
-        self.persist_stop = Event()
-        self.data_lock = Lock()
-        self.data_changed = Event()
-        self.dirty = False
-        self.last_save = -1  # this will be populated by time.time() during runtime.
+        # Index lookups on the request path take `_read_lock`. With a single
+        # request thread there is no concurrent writer to guard those against,
+        # and only the persist thread's snapshot needs excluding from writes.
+        self._read_lock: ContextManager
+        if threaded:
+            self.data_lock = ReadWriteLock()
+            self._read_lock = self.data_lock.read
+        else:
+            self.data_lock = ExclusiveLock()
+            self._read_lock = nullcontext()
+        # Writers bump the change version, under the write lock, and notify
+        # the persist loop, which tracks the last version it persisted.
+        # A version counts as persisted once the writer thread has written its
+        # snapshot; if that fails, the loop takes and writes a new snapshot.
+        self._changes = Condition()
+        self._change_version = 0
+        self._snapshot_version = 0
+        self._persisted_version = 0
+        self._stopping = False
+        # serialized snapshots and their versions, awaiting the writer thread,
+        # so the persist loop never waits on disk I/O; `None` stops the writer
+        self._write_queue: Queue[tuple[int, bytes] | None] = Queue(maxsize=1)
+        # resources changed since the last persist, and the cached JSON
+        # of each resource's record list as of its last persist
+        self._dirty_resources: set[str] = set()
+        self._resource_fragments: dict[str, bytes] = {}
+        # resource -> fields registered for indexing; each index is built on
+        # the first lookup of its field
+        self._indexed_fields: dict[str, set[str]] = {}
+        # resource -> field -> casefolded value -> record ids; the id dicts
+        # are used as insertion-ordered sets
+        self._indexes: dict[str, dict[str, dict[str, dict[str, None]]]] = {}
+        # resource -> record id -> a number increasing with the record's position
+        # in the record map, to put index matches in record order
+        self._positions: dict[str, dict[str, int]] = {}
+        self._position_sequence = count()
+        # serialized full record lists, with the record map each was built from
+        self._list_cache: dict[str, tuple[dict[str, dict[str, Any]], bytes]] = {}
+        # populated by time.monotonic() during runtime, so clock changes
+        # can neither stall nor skip the debounce period.
+        self.last_save = float("-inf")
         self.logger = LOGGER.getChild(type(self).__name__)
         if not self.db_file:
             self.logger.warning("JSON DB Filepath not provided.")
@@ -66,102 +115,389 @@ class JsonDatabase(object):
         else:
             try:
                 self.logger.info(f"Loading existing JSON DB from file: {db_file}")
-                with self.data_lock, self.db_file.open() as db:
+                content = json_codec.loads(self.db_file.read_bytes())
+                with self.data_lock.write:
                     self.records.update(
                         {
-                            resource: {
-                                record[self.id_field]: record
+                            intern(resource): {
+                                record[self.id_field]: self._intern_keys(record)
                                 for record in resource_records
                             }
-                            for resource, resource_records in json.load(db).items()
+                            for resource, resource_records in content.items()
                         }
                     )
+                    for resource, records in self.records.items():
+                        self._positions[resource] = dict(
+                            zip(records, self._position_sequence)
+                        )
+                    self._update_resource_names()
             except Exception as ex:  # pylint: disable=broad-exception-caught
                 self.logger.warning(f"Error Loading JSON DB from file {db_file}: {ex}")
 
     def maintain_data_persistence(self):
         """A Threaded event loop to persist data changes, but not too often."""
-        while not self.persist_stop.is_set():
-            self.data_changed.wait()
-            now = time()
-            # debounce to prevent disk thrashing
-            if now - self.last_save < self.persist_period_limit:
-                try:
-                    self.persist_stop.wait(
-                        self.persist_period_limit + self.last_save - now
-                    )
-                except TimeoutError:
-                    pass  # we didn't stop the program. this is normal.
-            if self.dirty:
-                self._persist()
+        writer = None
+        if self.db_file:
+            writer = Thread(
+                target=self._write_snapshots,
+                args=(self.db_file,),
+                name="JsonDatabaseWriter",
+            )
+            writer.start()
+        try:
+            stopping = False
+            while not stopping:
+                with self._changes:
+                    while not (self._needs_snapshot() or self._stopping):
+                        self._changes.wait()
+                    # debounce to prevent disk thrashing
+                    while not self._stopping:
+                        remaining = (
+                            self.persist_period_limit + self.last_save - monotonic()
+                        )
+                        if remaining <= 0:
+                            break
+                        self._changes.wait(remaining)
+                    stopping = self._stopping
+                if self._needs_snapshot():
+                    try:
+                        self._persist()
+                    except Exception:  # pylint: disable=broad-exception-caught
+                        # the changes stay pending, to be retried after the period
+                        self.logger.exception("Error persisting JSON DB changes")
+        finally:
+            if writer is not None:
+                # let the writer finish the final snapshot before returning
+                self._write_queue.put(None)
+                writer.join()
+
+    def _write_snapshots(self, db_file: Path):
+        """Writes the snapshots handed over by `_persist` to disk, until stopped"""
+        # write beside the DB file and swap it in, so a crash mid-write
+        # can't leave a truncated DB file behind
+        tmp_file = db_file.with_suffix(db_file.suffix + ".tmp")
+        while (snapshot := self._write_queue.get()) is not None:
+            version, content = snapshot
+            try:
+                with tmp_file.open("wb") as db:
+                    db.write(content)
+                os.replace(tmp_file, db_file)
+            except Exception as ex:  # pylint: disable=broad-exception-caught
+                self.logger.warning(f"Error Writing JSON DB to file {db_file}: {ex}")
+                with self._changes:
+                    # unless a newer snapshot is already queued, have the
+                    # persist loop take another, to be retried after the period
+                    if self._snapshot_version == version:
+                        self._snapshot_version = self._persisted_version
+                        self._changes.notify()
+            else:
+                with self._changes:
+                    self._persisted_version = version
+
+    def _mark_changed(self, resource: str):
+        """Records a change to a resource, to be persisted and evicted from caches.
+        Must be called while holding the write lock."""
+        self._dirty_resources.add(resource)
+        self._list_cache.pop(resource, None)
+        with self._changes:
+            self._change_version += 1
+            self._changes.notify()
+
+    @property
+    def dirty(self) -> bool:
+        """Whether there are changes which haven't been persisted yet"""
+        return self._change_version != self._persisted_version
+
+    def _needs_snapshot(self) -> bool:
+        """Whether there are changes which haven't been handed to the writer,
+        or whose snapshot failed to be written"""
+        return self._change_version != self._snapshot_version
 
     def _persist(self):
         """Saves the current state of the records to disk"""
-        self.last_save = time()
+        self.last_save = monotonic()
         if not self.db_file:
+            self._snapshot_version = self._persisted_version = self._change_version
             if not hasattr(self, "__db_file_missing_warning_sent"):
                 setattr(self, "__db_file_missing_warning_sent", True)
                 print("No database file specified.")
             return
         self.logger.info("Writing JSON DB changes to storage...")
-        with self.data_lock, self.db_file.open("w+") as db:
-            if self.data_changed.is_set():
-                self.data_changed.clear()
-            self.dirty = False
-            json.dump(
-                {
-                    resource: list(resource_records.values())
-                    for resource, resource_records in self.records.items()
-                },
-                db,
-                indent=2,
-            )
+        # serialize under the read lock, and leave the disk I/O to the writer
+        with self.data_lock.read:
+            dirty_resources = self._dirty_resources
+            # only re-serialize the resources which changed since the last save
+            for resource, resource_records in self.records.items():
+                if (
+                    resource in dirty_resources
+                    or resource not in self._resource_fragments
+                ):
+                    self._resource_fragments[resource] = self._serialize_fragment(
+                        resource_records
+                    )
+            content = self._join_fragments(self.records.keys())
+            # writers are excluded, so this snapshot is of exactly this version;
+            # it is only taken once serialized, so that a failure leaves the
+            # changes pending
+            self._dirty_resources = set()
+            version = self._change_version
+            with self._changes:
+                self._snapshot_version = version
+        self._queue_write(version, content)
+
+    def _queue_write(self, version: int, content: bytes):
+        """Hands a snapshot to the writer thread, superseding any snapshot
+        which is still waiting to be written"""
+        while True:
+            try:
+                self._write_queue.put_nowait((version, content))
+                return
+            except Full:
+                try:
+                    self._write_queue.get_nowait()
+                except Empty:
+                    pass
+
+    @staticmethod
+    def _serialize_fragment(resource_records: dict[str, dict[str, Any]]) -> bytes:
+        """Serializes a resource's records, indented to nest inside the DB file"""
+        # JSON strings cannot contain raw newlines, so this only touches indentation
+        return json_codec.dumps_indented(list(resource_records.values())).replace(
+            b"\n", b"\n  "
+        )
+
+    def _join_fragments(self, resources: Iterable[str]) -> bytes:
+        """Assembles the DB file content from the cached resource fragments"""
+        fragments = self._resource_fragments
+        members = [
+            b"  %s: %s" % (json_codec.dumps(resource), fragments[resource])
+            for resource in resources
+        ]
+        if not members:
+            return b"{}"
+        return b"{\n" + b",\n".join(members) + b"\n}"
 
     def shutdown(self):
         """Stop the persist event loop and save current state to disk."""
         # don't need to wait, shutting down
         self.persist_period_limit = 0
-        self.persist_stop.set()
-        self.data_changed.set()
+        with self._changes:
+            self._stopping = True
+            self._changes.notify()
 
-    def available_resources(self):
+    @staticmethod
+    def _intern_keys(record: dict[str, Any]) -> dict[str, Any]:
+        """A copy of a record with interned field names, so the records of a
+        resource share their key strings and key comparisons are by identity"""
+        return {intern(key): value for key, value in record.items()}
+
+    def available_resources(self) -> frozenset[str]:
         """Returns the set of currently available resources"""
-        return sorted(set(self.records.keys()))
+        return self._resource_set
+
+    def has_resource(self, resource: str) -> bool:
+        """Whether a resource exists"""
+        return resource in self.records
+
+    def sorted_resources(self) -> tuple[str, ...]:
+        """Returns the names of the currently available resources, in sorted order"""
+        return self._sorted_resources
+
+    def _update_resource_names(self):
+        """Replaces the resource name snapshots after a resource is added.
+        Must be called while holding the write lock."""
+        self._resource_set = frozenset(self.records)
+        self._sorted_resources = tuple(sorted(self._resource_set))
+
+    def _writable_records(self, resource: str) -> dict[str, dict[str, Any]]:
+        """The current record map of a resource, adding the resource if it is new.
+        Must be called while holding the write lock."""
+        records = self.records.get(resource)
+        if records is None:
+            records = self.records[intern(resource)] = {}
+            self._update_resource_names()
+        return records
+
+    @staticmethod
+    def _index_key(value: Any) -> str | None:
+        """The index key for a record value, matching equality filter semantics"""
+        return None if value is None else str(value).casefold()
+
+    def register_index(self, resource: str, field: str):
+        """Maintains an index of a resource's records by the value of a field,
+        so equality lookups on that field don't have to scan every record.
+
+        The index is built on the first lookup of the field."""
+        with self.data_lock.write:
+            self._indexed_fields.setdefault(resource, set()).add(field)
+
+    def is_indexed(self, resource: str, field: str) -> bool:
+        """Whether a field of a resource has a registered index"""
+        return field in self._indexed_fields.get(resource, ())
+
+    def _ensure_indexes(self, resource: str, fields: Iterable[str]):
+        """Builds the indexes of registered fields which haven't been looked up yet"""
+        built = self._built_indexes(resource)
+        missing = [field for field in fields if field not in built]
+        if not missing:
+            return
+        with self.data_lock.write:
+            for field in missing:
+                if not self.is_indexed(resource, field):
+                    raise JsonDatabaseError(
+                        f"Field {field} of resource {resource} is not indexed"
+                    )
+                # another thread may have built it while we waited
+                if field not in self._built_indexes(resource):
+                    self._build_index(resource, field)
+
+    def _built_indexes(self, resource: str) -> dict[str, dict[str, dict[str, None]]]:
+        """The indexes built so far for a resource, by field"""
+        return self._indexes.get(resource, {})
+
+    def _build_index(self, resource: str, field: str):
+        """Indexes a resource's records by a field.
+        Must be called while holding the write lock."""
+        self.logger.debug(f"Indexing resource {resource} by field {field}")
+        index: dict[str, dict[str, None]] = {}
+        for record_id, record in self.records.get(resource, {}).items():
+            key = self._index_key(record.get(field))
+            if key is not None:
+                index.setdefault(key, {})[record_id] = None
+        self._indexes.setdefault(resource, {})[field] = index
+
+    def _reindex(
+        self,
+        resource: str,
+        record_id: str,
+        old: Mapping[str, Any] | None,
+        new: Mapping[str, Any] | None,
+    ):
+        """Moves a record between index entries as its field values change,
+        and tracks the positions of records added to or removed from a resource.
+        Must be called while holding the write lock."""
+        if old is None:
+            positions = self._positions.setdefault(resource, {})
+            positions[record_id] = next(self._position_sequence)
+        elif new is None:
+            del self._positions[resource][record_id]
+        for field, index in self._built_indexes(resource).items():
+            old_key = self._index_key(old.get(field)) if old is not None else None
+            new_key = self._index_key(new.get(field)) if new is not None else None
+            if old_key == new_key:
+                continue
+            if old_key is not None:
+                record_ids = index[old_key]
+                del record_ids[record_id]
+                if not record_ids:
+                    del index[old_key]
+            if new_key is not None:
+                index.setdefault(new_key, {})[record_id] = None
 
     def list_resource(
         self,
         resource: str,
         fields: list[str] | set[str] | None = None,
         filters: list[Callable[[dict[str, Any]], bool]] | None = None,
+        lookups: list[tuple[str, str]] | None = None,
     ):
-        """Lists all records from a resource"""
-
-        if resource not in self.records:
-            raise NotFound(f"Unknown Resource {resource}")
-        resource_records: Iterable[dict[str, Any]] = self.records[resource].values()
+        """Lists all records from a resource
+
+        Unless `fields` are selected, the listed records are the stored records
+        themselves, not copies; callers must not modify them.
+        `lookups` are (field, value) equality criteria answered from the
+        resource's indexes; each field must have a registered index.
+        """
+        filters = filters or []
+        field_set = frozenset(map(intern, fields)) if fields else None
+        if lookups:
+            self._ensure_indexes(resource, {field for field, _ in lookups})
+
+        resource_records: Iterable[dict[str, Any]]
+        if lookups:
+            # the indexes change in place, so they are read under the lock,
+            # along with the record map they currently describe
+            with self._read_lock:
+                records = self._resource_records(resource)
+                resource_records = self._lookup_records(resource, records, lookups)
+        else:
+            resource_records = self._resource_records(resource).values()
 
+        # filter and project each record in a single pass, skipping the
+        # per-record filter check when there are no filters
         if filters:
-            for record_filter in filters:
-                resource_records = filter(record_filter, resource_records)
-        if fields:
-            resource_records = [
-                {key: value for key, value in record.items() if key in fields}
+            resource_records = (
+                record
+                for record in resource_records
+                if all(record_filter(record) for record_filter in filters)
+            )
+        if field_set:
+            return [
+                {key: value for key, value in record.items() if key in field_set}
                 for record in resource_records
             ]
-        return [record.copy() for record in resource_records]
+        return list(resource_records)
+
+    def list_resource_serialized(self, resource: str) -> bytes:
+        """Lists all records from a resource, as serialized JSON"""
+        records = self._resource_records(resource)
+        cached = self._list_cache.get(resource)
+        # the cache entry is only current if it was built from this record map
+        if cached is not None and cached[0] is records:
+            return cached[1]
+        serialized = json_codec.dumps(list(records.values()))
+        self._list_cache[resource] = (records, serialized)
+        return serialized
+
+    def _resource_records(self, resource: str) -> dict[str, dict[str, Any]]:
+        """The current record map of a resource, which is never modified"""
+        records = self.records.get(resource)
+        if records is None:
+            raise NotFound(f"Unknown Resource {resource}")
+        return records
+
+    def _lookup_records(
+        self,
+        resource: str,
+        records: dict[str, dict[str, Any]],
+        lookups: list[tuple[str, str]],
+    ):
+        """Records matching all of the equality lookups, found via the indexes,
+        in the same order as a scan of the resource would list them"""
+        indexes = self._indexes[resource]
+        matches = sorted(
+            (indexes[field].get(value.casefold(), {}) for field, value in lookups),
+            key=len,
+        )
+        smallest, rest = matches[0], matches[1:]
+        matched = [
+            record_id
+            for record_id in smallest
+            if all(record_id in record_ids for record_ids in rest)
+        ]
+        # index entries are in insertion order, which drifts from record order
+        # as records move between entries, so sort just the matches into place
+        matched.sort(key=self._positions[resource].__getitem__)
+        return [records[record_id] for record_id in matched]
 
     def read(self, resource: str, record_id: str):
-        """Reads a record by id from a resource."""
-        if resource not in self.records:
-            raise NotFound(f"Unknown Resource {resource}")
-        if record_id not in self.records[resource]:
+        """Reads a record by id from a resource.
+
+        Returns the stored record itself, not a copy; callers must not modify it.
+        """
+        record = self._resource_records(resource).get(record_id)
+        if record is None:
             raise NotFound(
                 f"Record [{record_id}] does not exist for resource {resource}"
             )
-        return self.records[resource][record_id].copy()
+        return record
 
     def create(self, resource, record, record_id: Optional[str] = None):
-        """Inserts a record into a resource."""
+        """Inserts a record into a resource.
+
+        Returns the stored record itself, not a copy; callers must not modify it.
+        """
+        record = self._intern_keys(record)
         if record_id:
             record[self.id_field] = record_id
         elif self.id_field in record:
@@ -171,20 +507,24 @@ class JsonDatabase(object):
             record_id = str(uuid.uuid4())
             record[self.id_field] = record_id
 
-        if resource in self.records and record_id in self.records[resource]:
-            raise DuplicateValue(f"Duplicate Record ID on resource {resource}")
-
-        with self.data_lock:
-            self.records[resource][record_id] = record
-            self.dirty = True
-            self.data_changed.set()
+        with self.data_lock.write:
+            records = self._writable_records(resource)
+            if record_id in records:
+                raise DuplicateValue(f"Duplicate Record ID on resource {resource}")
+            self.records[resource] = {**records, record_id: record}
+            self._reindex(resource, record_id, None, record)
+            self._mark_changed(resource)
 
-        return record.copy()
+        return record
 
     def set(
         self, resource: str, record: dict[str, Any], record_id: Optional[str] = None
     ):
-        """Replaces a record in a resource with the provided record."""
+        """Replaces a record in a resource with the provided record.
+
+        Returns the stored record itself, not a copy; callers must not modify it.
+        """
+        record = self._intern_keys(record)
         if record_id:
             record[self.id_field] = record_id
         elif self.id_field in record:
@@ -192,44 +532,58 @@ class JsonDatabase(object):
 
         if not record_id:
             raise MissingId("Missing ID for record")
-        with self.data_lock:
-            self.records[resource][record_id] = record
-            self.dirty = True
-            self.data_changed.set()
+        with self.data_lock.write:
+            records = self._writable_records(resource)
+            previous = records.get(record_id)
+            self.records[resource] = {**records, record_id: record}
+            self._reindex(resource, record_id, previous, record)
+            self._mark_changed(resource)
 
-        return record.copy()
+        return record
 
     def update(
         self, resource: str, record: dict[str, Any], record_id: Optional[str] = None
     ):
-        """Performs a partial update on a record of a resource."""
+        """Performs a partial update on a record of a resource.
+
+        Returns the stored record itself, not a copy; callers must not modify it.
+        """
+        record = self._intern_keys(record)
         if record_id:
             record[self.id_field] = record_id
         elif self.id_field in record:
             record_id = record[self.id_field]
 
-        if record_id not in self.records[resource]:
-            raise NotFound(
-                f"Record [{record_id}] does not exist for resource {resource}"
-            )
-        with self.data_lock:
-            self.records[resource][record_id].update(record)
-            self.dirty = True
-            self.data_changed.set()
-
-        return self.records[resource][record_id].copy()
+        with self.data_lock.write:
+            records = self.records.get(resource)
+            if records is None:
+                raise NotFound(f"Unknown Resource {resource}")
+            existing = records.get(record_id)
+            if existing is None:
+                raise NotFound(
+                    f"Record [{record_id}] does not exist for resource {resource}"
+                )
+            updated = {**existing, **record}
+            self.records[resource] = {**records, record_id: updated}
+            self._reindex(resource, record_id, existing, updated)
+            self._mark_changed(resource)
+            return updated
 
     def delete(self, resource: str, record_id: str):
         """Deletes the a record from a resource by ID"""
-        if resource not in self.records:
-            raise NotFound(f"Unknown Resource {resource}")
-        if record_id not in self.records[resource]:
-            raise NotFound(
-                f"Record [{record_id}] does not exist for resource {resource}"
-            )
-        with self.data_lock:
-            del self.records[resource][record_id]
-            self.dirty = True
-            self.data_changed.set()
+        with self.data_lock.write:
+            records = self.records.get(resource)
+            if records is None:
+                raise NotFound(f"Unknown Resource {resource}")
+            previous = records.get(record_id)
+            if previous is None:
+                raise NotFound(
+                    f"Record [{record_id}] does not exist for resource {resource}"
+                )
+            remaining = dict(records)
+            del remaining[record_id]
+            self.records[resource] = remaining
+            self._reindex(resource, record_id, previous, None)
+            self._mark_changed(resource)
 
         return None
@@ -0,0 +1,36 @@
+"""JSON encoding and decoding, accelerated by orjson when it is installed"""
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.JSONDecodeError is a subclass of json.JSONDecodeError
+JSONDecodeError = json.JSONDecodeError
+
+
+def dumps(payload: Any) -> bytes:
+    """Serialize a payload to compact UTF-8 encoded JSON"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    # escaping non-ASCII keeps lone surrogates, which json.loads accepts
+    # but UTF-8 can't encode, serializable
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def dumps_indented(payload: Any) -> bytes:
+    """Serialize a payload to UTF-8 encoded JSON, indented by two spaces"""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_INDENT_2)
+    return json.dumps(payload, indent=2).encode()
+
+
+def loads(content: bytes | bytearray | memoryview | str) -> Any:
+    """Deserialize JSON content"""
+    if orjson is not None:
+        return orjson.loads(content)
+    if isinstance(content, memoryview):
+        content = content.tobytes()
+    return json.loads(content)
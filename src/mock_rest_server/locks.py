@@ -0,0 +1,82 @@
+"""Locking primitives for sharing the JSON database between request threads"""
+from threading import Condition, Lock
+from typing import Callable
+
+
+class _LockSide:
+    """Context manager wrapping one side (shared or exclusive) of a ReadWriteLock"""
+
+    def __init__(self, acquire: Callable[[], None], release: Callable[[], None]):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+
+    def __exit__(self, *exc_info):
+        self._release()
+
+
+class ReadWriteLock:
+    """A lock which admits any number of concurrent readers, or a single writer.
+
+    Use `with lock.read:` for shared access and `with lock.write:` for
+    exclusive access. Waiting writers take priority over new readers,
+    so a steady stream of reads cannot starve out a mutation.
+    Neither side is reentrant.
+    """
+
+    def __init__(self):
+        # the uncontended paths use the bare lock, skipping the Condition's
+        # Python-level wrappers; the condition is only touched to wait or notify
+        self._lock = Lock()
+        self._condition = Condition(self._lock)
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+        self.read = _LockSide(self.acquire_read, self.release_read)
+        self.write = _LockSide(self.acquire_write, self.release_write)
+
+    def acquire_read(self):
+        """Acquire shared access, waiting for any active or pending writers."""
+        with self._lock:
+            while self._writer or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        """Release shared access."""
+        with self._lock:
+            self._readers -= 1
+            # only a pending writer can be waiting on the last reader
+            if not self._readers and self._writers_waiting:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        """Acquire exclusive access, waiting for all active readers to finish."""
+        with self._lock:
+            self._writers_waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._condition.wait()
+            except BaseException:
+                # readers may be held back by this writer; let them through
+                self._writers_waiting -= 1
+                self._condition.notify_all()
+                raise
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        """Release exclusive access."""
+        with self._lock:
+            self._writer = False
+            self._condition.notify_all()
+
+
+class ExclusiveLock:
+    """A plain mutual exclusion lock, exposing the same `read` and `write`
+    sides as a ReadWriteLock. Both sides acquire the same underlying lock."""
+
+    def __init__(self):
+        self.read = self.write = Lock()
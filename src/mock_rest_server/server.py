@@ -6,9 +6,14 @@ getrecord returns utf8-encoded json.
 
 from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler
-import json
 from urllib import parse
-from typing import Any, Callable
+from typing import Any
+from logging import INFO, WARNING, getLogger
+from threading import local
+from functools import lru_cache
+from itertools import chain
+from email.utils import formatdate
+from time import time
 import traceback
 from .database import (
     JsonDatabase,
@@ -18,7 +23,13 @@ from .database import (
     MissingId,
 )
 
-from .data_filters import build_query_filter
+from .data_filters import build_field_filter, has_wild_card
+from .json_codec import JSONDecodeError, dumps, loads
+
+LOGGER = getLogger(__name__)
+
+# per-thread request body buffers, reused across requests
+_body_buffers = local()
 
 ERROR_RESPONSE_LOOKUP = {
     DuplicateValue: HTTPStatus.BAD_REQUEST,
@@ -27,7 +38,31 @@ ERROR_RESPONSE_LOOKUP = {
 }
 
 CONTENT_TYPE_HEADER = "Content-Type"
+CONTENT_LENGTH_HEADER = "Content-Length"
+TRANSFER_ENCODING_HEADER = "Transfer-Encoding"
 JSON_CONTENT_TYPE = "application/json"
+# response bodies up to this size are copied in behind the headers, to send the
+# whole response in one write; larger bodies are written out on their own
+COALESCED_BODY_LIMIT = 64 * 1024
+# request bodies up to this size are read into a reused per-thread buffer;
+# larger ones are read in chunks of this size, as they arrive
+BODY_BUFFER_SIZE = 64 * 1024
+# seconds to wait on a client socket, including idle keep-alive connections
+CONNECTION_TIMEOUT = 5
+
+# escapes control characters in logged request lines and headers, as the
+# stdlib BaseHTTPRequestHandler.log_message() does, so clients can't inject
+# terminal escape sequences into the logs
+_CONTROL_CHAR_TABLE = str.maketrans(
+    {c: rf"\x{c:02x}" for c in chain(range(0x20), range(0x7F, 0xA0))}
+)
+_CONTROL_CHAR_TABLE[ord("\\")] = r"\\"
+
+
+@lru_cache(maxsize=1)
+def _http_date(timestamp: int) -> str:
+    """The Date header value for a second, formatted once per second"""
+    return formatdate(timestamp, usegmt=True)
 
 
 class RequestBodyReadError(ValueError):
@@ -45,11 +80,30 @@ class JsonHttpResponse:
     status: HTTPStatus
     has_body: bool
     body: Any
-
-    def __init__(self, status: HTTPStatus, has_body: bool, body: Any):
+    encoded: bytes | None
+
+    def __init__(
+        self,
+        status: HTTPStatus,
+        has_body: bool,
+        body: Any,
+        encoded: bytes | None = None,
+    ):
         self.status = status
         self.has_body = has_body
         self.body = body
+        self.encoded = encoded
+
+    def encoded_body(self) -> bytes:
+        """The response body, encoded as JSON"""
+        if self.encoded is None:
+            return dumps(self.body)
+        return self.encoded
+
+    def preencoded(self):
+        """Encodes the body once up front, for a response which is sent repeatedly"""
+        self.encoded = dumps(self.body)
+        return self
 
     @classmethod
     def empty(cls, status=HTTPStatus.NO_CONTENT):
@@ -61,6 +115,11 @@ class JsonHttpResponse:
         """Build a response with a payload"""
         return cls(status, True, payload)
 
+    @classmethod
+    def with_encoded_payload(cls, encoded: bytes, status=HTTPStatus.OK):
+        """Build a response with a payload which is already encoded as JSON"""
+        return cls(status, True, None, encoded)
+
     @classmethod
     def with_error(cls, message: str, status=HTTPStatus.BAD_REQUEST):
         """Build a response with an error message"""
@@ -85,14 +144,16 @@ class JsonHttpResponse:
 class _StandardResponses:
     """A collection of standard responses and standard response patterns"""
 
-    json_parse_error = JsonHttpResponse.with_error("Unable parse JSON payload")
+    json_parse_error = JsonHttpResponse.with_error(
+        "Unable parse JSON payload"
+    ).preencoded()
     internal_error = JsonHttpResponse.with_error(
         "There was an error processing your request.", HTTPStatus.INTERNAL_SERVER_ERROR
-    )
+    ).preencoded()
     not_found = JsonHttpResponse.with_error(
         "The requested resource could not be found.", HTTPStatus.NOT_FOUND
-    )
-    missing_id = JsonHttpResponse.with_error("Missing record ID")
+    ).preencoded()
+    missing_id = JsonHttpResponse.with_error("Missing record ID").preencoded()
 
     @staticmethod
     def unexpected_path(path: str):
@@ -123,6 +184,13 @@ class JsonHttpRequestHandler(BaseHTTPRequestHandler):
     WILD_CARD = "*"
     database: JsonDatabase | None = None
 
+    # keep connections open between requests, closing idle ones after a while
+    protocol_version = "HTTP/1.1"
+    timeout = CONNECTION_TIMEOUT
+    # whether to keep connections alive at all; a single-threaded server
+    # can't serve anyone else while a client holds its connection open
+    keep_alive = True
+
     # internal handler variables used by BaseHTTPRequestHandler
     raw_requestline: str
     requestline: str
@@ -130,16 +198,30 @@ class JsonHttpRequestHandler(BaseHTTPRequestHandler):
     command: str
     close_connection: bool
 
+    # the request path, parsed once per request by _parse_path()
+    url_path: str
+    path_segments: list[str]
+    query_string: str
+    # whether the request has a body which hasn't been read yet
+    body_pending: bool
+
     @classmethod
     def configure(cls, **kwargs):
         """Configure the request handler class"""
         if database := kwargs.pop("database", None):
             cls.database = database
+        if "keep_alive" in kwargs:
+            cls.keep_alive = kwargs.pop("keep_alive")
 
     def handle_one_request(self):
         """Handle a single HTTP request."""
         try:
-            self.raw_requestline = self.rfile.readline(65537)
+            try:
+                self.raw_requestline = self.rfile.readline(65537)
+            except TimeoutError:
+                # an idle keep-alive connection, which is no error
+                self.close_connection = True
+                return
             if len(self.raw_requestline) > 65536:
                 self.requestline = ""
                 self.request_version = ""
@@ -152,13 +234,20 @@ class JsonHttpRequestHandler(BaseHTTPRequestHandler):
             if not self.parse_request():
                 # An error code has been sent, just exit
                 return
-            mname = "respond_" + self.command.lower()
-            if not hasattr(self, mname):
-                raise NotImplementedError()
+            headers = self.headers
+            # a declared empty body has nothing left to read
+            self.body_pending = TRANSFER_ENCODING_HEADER in headers or (
+                headers.get(CONTENT_LENGTH_HEADER, "0").strip() != "0"
+            )
             try:
-                if not self.database:
+                responder = self._METHOD_DISPATCH.get(self.command)
+                if responder is None:
+                    raise NotImplementedError()
+                database = self.database
+                if database is None:
                     raise UninitializedDatabase()
-                response = getattr(self, mname)(self.database)
+                self._parse_path()
+                response = responder(self, database)
             except JsonDatabaseError as e:
                 response = JsonHttpResponse.from_database_error(e)
             except NotImplementedError:
@@ -169,16 +258,15 @@ class JsonHttpRequestHandler(BaseHTTPRequestHandler):
                 response = JsonHttpResponse.with_error(
                     "Database was not initialized", HTTPStatus.INTERNAL_SERVER_ERROR
                 )
+            except TimeoutError:
+                raise  # the client stalled mid-request; there's no one to answer
             except Exception as e:  # pylint: disable=broad-exception-caught
                 print(traceback.format_exc())
                 response = JsonHttpResponse.from_exception(e)
-            self.send_response(response.status)
-            if response.has_body:
-                self.send_header(CONTENT_TYPE_HEADER, JSON_CONTENT_TYPE)
-
-            self.end_headers()
-            if response.has_body:
-                self.wfile.write(json.dumps(response.body).encode())
+            if self.body_pending or not self.keep_alive:
+                # the next request can't be found after an unread body
+                self.close_connection = True
+            self.send_json_response(response)
             self.wfile.flush()  # actually send the response if not already done.
         except TimeoutError as e:
             # a read or a write timed out.  Discard this connection
@@ -186,6 +274,63 @@ class JsonHttpRequestHandler(BaseHTTPRequestHandler):
             self.close_connection = True
         return
 
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Log a request message through the logging module,
+        rather than writing it straight to stderr"""
+        self._log(INFO, format, args)
+
+    def log_error(self, format, *args):  # pylint: disable=redefined-builtin
+        """Log a request error through the logging module"""
+        self._log(WARNING, format, args)
+
+    def _log(
+        self, level: int, format: str, args: tuple
+    ):  # pylint: disable=redefined-builtin
+        """Log a request message, with control characters escaped"""
+        if LOGGER.isEnabledFor(level):
+            message = (format % args).translate(_CONTROL_CHAR_TABLE)
+            LOGGER.log(level, "%s - %s", self.address_string(), message)
+
+    def send_json_response(self, response: JsonHttpResponse):
+        """Send a response, with the status line, headers and (unless it is large)
+        the body in a single write"""
+        status = response.status
+        self.log_request(status)
+        body = b""
+        if response.has_body:
+            body = response.encoded_body()
+            content_headers = (
+                f"{CONTENT_TYPE_HEADER}: {JSON_CONTENT_TYPE}\r\n"
+                f"{CONTENT_LENGTH_HEADER}: {len(body)}\r\n"
+            )
+        elif status != HTTPStatus.NO_CONTENT:
+            content_headers = f"{CONTENT_LENGTH_HEADER}: 0\r\n"
+        else:
+            content_headers = ""
+        if self.request_version == "HTTP/0.9":
+            # HTTP/0.9 responses are the bare body
+            head = b""
+        else:
+            # build the head in one go, rather than through send_response()
+            # and send_header(), which format and buffer each line separately
+            connection = "close" if self.close_connection else "keep-alive"
+            head = (
+                f"{self.protocol_version} {status.value} {status.phrase}\r\n"
+                f"Server: {self.version_string()}\r\n"
+                f"Date: {_http_date(int(time()))}\r\n"
+                f"{content_headers}"
+                f"Connection: {connection}\r\n\r\n"
+            ).encode("latin-1")
+        if self.command == "HEAD":
+            # the headers describe the body a GET would have had, but a body
+            # here would be read as the start of the next response
+            body = b""
+        if len(body) <= COALESCED_BODY_LIMIT:
+            self.wfile.write(head + body)
+        else:
+            self.wfile.write(head)
+            self.wfile.write(body)
+
     def read_request_body(self):
         """Read the content of the Request body as JSON content."""
         ctype = self.headers.get(CONTENT_TYPE_HEADER.lower(), "")
@@ -195,15 +340,88 @@ class JsonHttpRequestHandler(BaseHTTPRequestHandler):
                 f"Expected `{JSON_CONTENT_TYPE}`"
             )
             raise ValueError(message)
+        if TRANSFER_ENCODING_HEADER in self.headers:
+            raise ValueError("Request bodies must be sent with a Content-Length")
 
-        length = int(self.headers.get("content-length", "0"))
+        try:
+            length = int(self.headers[CONTENT_LENGTH_HEADER])
+        except TypeError:
+            # no Content-Length header; an empty body
+            length = 0
+
+        body = self._read_body_bytes(length)
+        self.body_pending = False
+        return loads(body)
+
+    def _read_body_bytes(self, length: int) -> bytes | memoryview:
+        """Read the request body, into this thread's reusable buffer if it fits.
+
+        The returned view only ever covers bytes read for this request,
+        never what is left in the buffer from an earlier one."""
+        if length < 0:
+            raise ValueError("Content-Length must not be negative")
+        if length > BODY_BUFFER_SIZE:
+            # don't trust the client's Content-Length with one large
+            # allocation, nor keep a buffer that large around afterwards
+            chunks = []
+            while length > 0:
+                chunk = self.rfile.read(min(length, BODY_BUFFER_SIZE))
+                if not chunk:
+                    raise ValueError("Request body is shorter than its Content-Length")
+                chunks.append(chunk)
+                length -= len(chunk)
+            return b"".join(chunks)
+        buffer: bytearray | None = getattr(_body_buffers, "buffer", None)
+        if buffer is None:
+            buffer = _body_buffers.buffer = bytearray(BODY_BUFFER_SIZE)
+        body = memoryview(buffer)[:length]
+        received = 0
+        while received < length:
+            count = self.rfile.readinto(body[received:])
+            if not count:
+                raise ValueError("Request body is shorter than its Content-Length")
+            received += count
+        return body
+
+    def _read_json_body(self) -> tuple[Any, JsonHttpResponse | None]:
+        """Read the JSON request body, returning either the content
+        or the error response for a body which could not be read"""
+        try:
+            return self.read_request_body(), None
+        except JSONDecodeError:
+            return None, _StandardResponses.json_parse_error
+        except ValueError as er:
+            return None, JsonHttpResponse.from_exception(er, HTTPStatus.BAD_REQUEST)
 
-        return json.loads(self.rfile.read(length))
+    def _parse_path(self):
+        """Split the request path into its path segments and query string"""
+        if self.path.startswith(self.PATH_SEP):
+            # the usual origin-form target, which doesn't need urlsplit()
+            url_path, _, query_string = self.path.partition("#")[0].partition("?")
+        else:
+            url_parts = parse.urlsplit(self.path)
+            url_path, query_string = url_parts.path, url_parts.query
+        self.url_path = url_path
+        self.path_segments = url_path.lstrip(self.PATH_SEP).split(self.PATH_SEP)
+        self.query_string = query_string
+
+    def _parse_query(self) -> dict[str, list[str]]:
+        """Parse the query string into lists of values by parameter name"""
+        query_string = self.query_string
+        if "%" in query_string or "+" in query_string:
+            return parse.parse_qs(query_string)
+        # nothing to unquote, so split it directly, with parse_qs semantics
+        query_params: dict[str, list[str]] = {}
+        for pair in query_string.split("&"):
+            name, _, value = pair.partition("=")
+            # parse_qs drops blank values, and pairs without a "="
+            if value:
+                query_params.setdefault(name, []).append(value)
+        return query_params
 
     def respond_post(self, database: JsonDatabase) -> JsonHttpResponse:
         """Handler function for POST requests"""
-        url_parts = parse.urlsplit(self.path)
-        slices = url_parts.path.lstrip(self.PATH_SEP).split(self.PATH_SEP)
+        slices = self.path_segments
         if slices == [""]:
             return _StandardResponses.method_not_allowed(self.command, self.path)
 
@@ -215,43 +433,40 @@ class JsonHttpRequestHandler(BaseHTTPRequestHandler):
         else:
             record_id = None
 
-        try:
-            record = self.read_request_body()
+        record, error = self._read_json_body()
+        if error:
+            return error
 
-            created_record = database.create(
-                resource_type, record, record_id
-            )
+        created_record = database.create(resource_type, record, record_id)
 
-            return JsonHttpResponse.with_payload(created_record)
-        except json.JSONDecodeError:
-            return _StandardResponses.json_parse_error
-        except ValueError as er:
-            return JsonHttpResponse.from_exception(er, HTTPStatus.BAD_REQUEST)
+        return JsonHttpResponse.with_payload(created_record)
 
     def respond_get(self, database: JsonDatabase) -> JsonHttpResponse:
         """Handler function for GET requests"""
-        url_parts = parse.urlsplit(self.path)
-        slices = url_parts.path.lstrip(self.PATH_SEP).split(self.PATH_SEP)
+        slices = self.path_segments
         if slices == [""]:
             return JsonHttpResponse.with_payload(
-                {"resources": list(database.available_resources())}
+                {"resources": database.sorted_resources()}
             )
 
         resource_type, *rest = slices
-        if resource_type not in database.available_resources():
+        if not database.has_resource(resource_type):
             return _StandardResponses.not_found
 
         if not rest or rest == [""]:
-            query_fields = None
-            query_filters: list[Callable[[dict[str, Any]], bool]] = []
-            if url_parts.query:
-                query_params = parse.parse_qs(url_parts.query)
-                if self.FIELD_QUERY_PARAM in query_params:
-                    query_fields = query_params[self.FIELD_QUERY_PARAM]
-                query_filters = self.generate_search_filters(query_params)
+            query_params = self._parse_query()
+            query_fields = query_params.get(self.FIELD_QUERY_PARAM)
+            query_lookups, query_filters = self.generate_search_filters(
+                query_params, database, resource_type
+            )
+            if query_fields is None and not query_filters and not query_lookups:
+                # unfiltered listings are served from the serialized list cache
+                return JsonHttpResponse.with_encoded_payload(
+                    database.list_resource_serialized(resource_type)
+                )
 
             records = database.list_resource(
-                resource_type, query_fields, query_filters
+                resource_type, query_fields, query_filters, query_lookups
             )
 
             return JsonHttpResponse.with_payload(records)
@@ -266,38 +481,55 @@ class JsonHttpRequestHandler(BaseHTTPRequestHandler):
 
         return JsonHttpResponse.with_payload(record)
 
-    def generate_search_filters(self, query_params: dict[str, list[str]]):
-        """Generates the filtering functions for the list"""
+    def generate_search_filters(
+        self,
+        query_params: dict[str, list[str]],
+        database: JsonDatabase,
+        resource_type: str,
+    ):
+        """Generates the filtering functions for the list
+
+        Exact-match parameters on indexed fields are returned separately
+        as (field, value) lookups, to be answered from the index.
+        """
+        query_lookups = []
         query_filters = []
         for param, values in query_params.items():
             if param == self.FIELD_QUERY_PARAM:
                 continue
 
-            for value in values:
-                query_filters.append(build_query_filter(param, value, self.WILD_CARD))
-        return query_filters
+            if database.is_indexed(resource_type, param):
+                query_lookups.extend(
+                    (param, value)
+                    for value in values
+                    if not has_wild_card(value, self.WILD_CARD)
+                )
+                values = [
+                    value for value in values if has_wild_card(value, self.WILD_CARD)
+                ]
+            if values:
+                query_filters.append(
+                    build_field_filter(param, values, self.WILD_CARD)
+                )
+        return query_lookups, query_filters
 
     def respond_put(self, database: JsonDatabase) -> JsonHttpResponse:
         """PUT command response handler"""
-        url_parts = parse.urlsplit(self.path)
-        slices = url_parts.path.lstrip(self.PATH_SEP).split(self.PATH_SEP)
+        slices = self.path_segments
         if slices == [""]:
-            return _StandardResponses.method_not_allowed(self.command, url_parts.path)
+            return _StandardResponses.method_not_allowed(self.command, self.url_path)
 
         resource_type, *rest = slices
         if len(rest) > 1:
-            return _StandardResponses.unexpected_path(url_parts.path)
+            return _StandardResponses.unexpected_path(self.url_path)
         elif rest:
             record_id = rest[0]
         else:
             return _StandardResponses.missing_id
 
-        try:
-            record = self.read_request_body()
-        except json.JSONDecodeError:
-            return _StandardResponses.json_parse_error
-        except ValueError as er:
-            return JsonHttpResponse.from_exception(er, HTTPStatus.BAD_REQUEST)
+        record, error = self._read_json_body()
+        if error:
+            return error
 
         updated_record = database.set(resource_type, record, record_id)
 
@@ -305,42 +537,35 @@ class JsonHttpRequestHandler(BaseHTTPRequestHandler):
 
     def respond_patch(self, database: JsonDatabase) -> JsonHttpResponse:
         """PATCH command response handler"""
-        url_parts = parse.urlsplit(self.path)
-        slices = url_parts.path.lstrip(self.PATH_SEP).split(self.PATH_SEP)
+        slices = self.path_segments
         if slices == [""]:
-            return _StandardResponses.method_not_allowed(self.command, url_parts.path)
+            return _StandardResponses.method_not_allowed(self.command, self.url_path)
 
         resource_type, *rest = slices
         if len(rest) > 1:
-            return _StandardResponses.unexpected_path(url_parts.path)
+            return _StandardResponses.unexpected_path(self.url_path)
         elif rest:
             record_id = rest[0]
         else:
             return _StandardResponses.missing_id
 
-        try:
-            record = self.read_request_body()
-        except json.JSONDecodeError:
-            return _StandardResponses.json_parse_error
-        except ValueError as er:
-            return JsonHttpResponse.from_exception(er, HTTPStatus.BAD_REQUEST)
+        record, error = self._read_json_body()
+        if error:
+            return error
 
-        updated_record = database.update(
-            resource_type, record, record_id
-        )
+        updated_record = database.update(resource_type, record, record_id)
 
         return JsonHttpResponse.with_payload(updated_record)
 
     def respond_delete(self, database: JsonDatabase) -> JsonHttpResponse:
         """DELETE command response handler"""
-        url_parts = parse.urlsplit(self.path)
-        slices = url_parts.path.lstrip(self.PATH_SEP).split(self.PATH_SEP)
+        slices = self.path_segments
         if slices == [""]:
-            return _StandardResponses.method_not_allowed(self.command, url_parts.path)
+            return _StandardResponses.method_not_allowed(self.command, self.url_path)
 
         resource_type, *rest = slices
         if len(rest) > 1:
-            return _StandardResponses.unexpected_path(url_parts.path)
+            return _StandardResponses.unexpected_path(self.url_path)
 
         elif rest:
             record_id = rest[0]
@@ -350,3 +575,12 @@ class JsonHttpRequestHandler(BaseHTTPRequestHandler):
         database.delete(resource_type, record_id)
 
         return JsonHttpResponse.empty()
+
+    # responder for each supported request method
+    _METHOD_DISPATCH = {
+        "GET": respond_get,
+        "POST": respond_post,
+        "PUT": respond_put,
+        "PATCH": respond_patch,
+        "DELETE": respond_delete,
+    }
@@ -0,0 +1,213 @@
+"""Tests for the JSON database"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from time import monotonic, sleep
+from unittest import mock
+import json
+import unittest
+
+from mock_rest_server import database, json_codec
+from mock_rest_server.data_filters import build_query_filter
+from mock_rest_server.database import JsonDatabase, JsonDatabaseError, NotFound
+
+WAIT = 5
+
+
+class RecordTests(unittest.TestCase):
+    """Reading and writing records"""
+
+    def setUp(self):
+        self.db = JsonDatabase()
+
+    def test_update_leaves_previously_read_record_unchanged(self):
+        self.db.create("things", {"name": "a"}, "1")
+        before = self.db.read("things", "1")
+        after = self.db.update("things", {"name": "b"}, "1")
+        self.assertEqual(before, {"id": "1", "name": "a"})
+        self.assertEqual(after, {"id": "1", "name": "b"})
+        self.assertIs(self.db.read("things", "1"), after)
+
+    def test_listing_taken_before_a_write_is_unchanged(self):
+        self.db.create("things", {"name": "a"}, "1")
+        listing = self.db.list_resource("things")
+        self.db.create("things", {"name": "b"}, "2")
+        self.db.delete("things", "1")
+        self.assertEqual(listing, [{"id": "1", "name": "a"}])
+
+    def test_serialized_listing_follows_changes(self):
+        self.db.create("things", {"name": "a"}, "1")
+        first = self.db.list_resource_serialized("things")
+        self.assertIs(self.db.list_resource_serialized("things"), first)
+        self.db.update("things", {"name": "b"}, "1")
+        self.assertEqual(
+            json.loads(self.db.list_resource_serialized("things")),
+            [{"id": "1", "name": "b"}],
+        )
+
+    def test_unknown_resource(self):
+        with self.assertRaises(NotFound):
+            self.db.list_resource("nothing")
+        with self.assertRaises(NotFound):
+            self.db.update("nothing", {"name": "a"}, "1")
+        self.assertFalse(self.db.has_resource("nothing"))
+
+
+class IndexTests(unittest.TestCase):
+    """Index lookups agree with scanning the records"""
+
+    def setUp(self):
+        self.db = JsonDatabase()
+        self.db.register_index("things", "kind")
+        for record_id, kind in (("1", "x"), ("2", "y"), ("3", "x"), ("4", "X")):
+            self.db.create("things", {"kind": kind}, record_id)
+
+    def assert_lookup_matches_scan(self, value: str):
+        scanned = self.db.list_resource(
+            "things", filters=[build_query_filter("kind", value, "*")]
+        )
+        looked_up = self.db.list_resource("things", lookups=[("kind", value)])
+        self.assertEqual(looked_up, scanned)
+
+    def test_lookup_matches_scan(self):
+        self.assert_lookup_matches_scan("x")
+        self.assert_lookup_matches_scan("y")
+        self.assert_lookup_matches_scan("z")
+
+    def test_lookup_keeps_record_order_after_updates(self):
+        self.db.update("things", {"kind": "y"}, "1")
+        self.db.update("things", {"kind": "x"}, "1")
+        self.assert_lookup_matches_scan("x")
+        looked_up = self.db.list_resource("things", lookups=[("kind", "x")])
+        self.assertEqual([rec["id"] for rec in looked_up], ["1", "3", "4"])
+
+    def test_lookup_follows_deletes(self):
+        self.db.delete("things", "3")
+        self.assert_lookup_matches_scan("x")
+
+    def test_only_registered_fields_are_indexed(self):
+        self.db.list_resource("things", filters=[build_query_filter("id", "1", "*")])
+        self.assertTrue(self.db.is_indexed("things", "kind"))
+        self.assertFalse(self.db.is_indexed("things", "id"))
+        with self.assertRaises(JsonDatabaseError):
+            self.db.list_resource("things", lookups=[("id", "1")])
+
+    def test_index_is_built_on_first_lookup(self):
+        built = self.db._built_indexes  # pylint: disable=protected-access
+        self.assertNotIn("kind", built("things"))
+        self.db.list_resource("things", lookups=[("kind", "x")])
+        self.assertIn("kind", built("things"))
+
+    def test_lookup_keeps_record_order_of_loaded_records(self):
+        with TemporaryDirectory() as tmp_dir:
+            db_file = Path(tmp_dir) / "db.json"
+            records = [{"id": str(i), "kind": "xy"[i % 2]} for i in range(6)]
+            db_file.write_text(json.dumps({"things": records}), encoding="utf-8")
+            db = JsonDatabase(db_file)
+        db.register_index("things", "kind")
+        db.list_resource("things", lookups=[("kind", "x")])
+        db.update("things", {"kind": "y"}, "0")
+        db.update("things", {"kind": "x"}, "0")
+        looked_up = db.list_resource("things", lookups=[("kind", "x")])
+        self.assertEqual([rec["id"] for rec in looked_up], ["0", "2", "4"])
+
+
+class PersistenceTests(unittest.TestCase):
+    """Saving the records to the DB file"""
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.db_file = Path(self.tmp_dir.name) / "db.json"
+        self.db = JsonDatabase(self.db_file, persist_period_limit=0)
+        self.loop = Thread(target=self.db.maintain_data_persistence, daemon=True)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def stop(self):
+        self.db.shutdown()
+        self.loop.join(WAIT)
+        self.assertFalse(self.loop.is_alive())
+
+    def test_saves_on_shutdown(self):
+        self.loop.start()
+        self.db.create("things", {"name": "a"}, "1")
+        self.stop()
+        self.assertEqual(
+            json.loads(self.db_file.read_text(encoding="utf-8")),
+            {"things": [{"id": "1", "name": "a"}]},
+        )
+        self.assertEqual(list(self.db_file.parent.iterdir()), [self.db_file])
+        self.assertEqual(JsonDatabase(self.db_file).read("things", "1")["name"], "a")
+
+    def test_keeps_persisting_after_a_failed_save(self):
+        serialize = JsonDatabase._serialize_fragment  # pylint: disable=protected-access
+        failed = Event()
+
+        def fail_once(resource_records):
+            if not failed.is_set():
+                failed.set()
+                raise ValueError("can't serialize")
+            return serialize(resource_records)
+
+        with mock.patch.object(
+            JsonDatabase, "_serialize_fragment", staticmethod(fail_once)
+        ), self.assertLogs(self.db.logger, "ERROR"):
+            self.loop.start()
+            self.db.create("things", {"name": "a"}, "1")
+            self.assertTrue(failed.wait(WAIT))
+            self.db.create("things", {"name": "b"}, "2")
+            self.stop()
+        self.assertEqual(
+            [rec["id"] for rec in json.loads(self.db_file.read_bytes())["things"]],
+            ["1", "2"],
+        )
+
+    def test_retries_a_failed_write(self):
+        replace = database.os.replace
+        failed = Event()
+
+        def fail_once(src, dst):
+            if not failed.is_set():
+                failed.set()
+                raise OSError("disk full")
+            replace(src, dst)
+
+        with mock.patch.object(database.os, "replace", fail_once), self.assertLogs(
+            self.db.logger, "WARNING"
+        ):
+            self.loop.start()
+            self.db.create("things", {"name": "a"}, "1")
+            self.assertTrue(failed.wait(WAIT))
+            # no further changes: the failed snapshot alone must be retried
+            deadline = monotonic() + WAIT
+            while self.db.dirty and monotonic() < deadline:
+                sleep(0.01)
+            self.assertFalse(self.db.dirty)
+            self.assertTrue(self.db_file.exists())
+            self.stop()
+        self.assertEqual(
+            json.loads(self.db_file.read_bytes()), {"things": [{"id": "1", "name": "a"}]}
+        )
+
+
+class JsonCodecTests(unittest.TestCase):
+    """JSON encoding, with or without orjson"""
+
+    def test_lone_surrogates_are_rejected_or_encodable(self):
+        try:
+            record = json_codec.loads(b'{"name": "\\ud800"}')
+        except json_codec.JSONDecodeError:
+            return
+        self.assertEqual(json.loads(json_codec.dumps(record)), record)
+        self.assertEqual(json.loads(json_codec.dumps_indented(record)), record)
+
+    def test_stdlib_fallback_encodes_lone_surrogates(self):
+        with mock.patch.object(json_codec, "orjson", None):
+            record = json_codec.loads(b'{"name": "\\ud800"}')
+            self.assertEqual(json.loads(json_codec.dumps(record)), record)
+            self.assertEqual(json.loads(json_codec.dumps_indented(record)), record)
+
+
+if __name__ == "__main__":
+    unittest.main()
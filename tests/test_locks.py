@@ -0,0 +1,94 @@
+"""Tests for the database locking primitives"""
+from threading import Barrier, Event, Thread
+import unittest
+
+from mock_rest_server.locks import ExclusiveLock, ReadWriteLock
+
+WAIT = 5
+
+
+def _start(target) -> Thread:
+    thread = Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+class ReadWriteLockTests(unittest.TestCase):
+    """ReadWriteLock semantics"""
+
+    def test_readers_share_the_lock(self):
+        lock = ReadWriteLock()
+        both_inside = Barrier(2, timeout=WAIT)
+
+        def reader():
+            with lock.read:
+                both_inside.wait()
+
+        threads = [_start(reader), _start(reader)]
+        for thread in threads:
+            thread.join(WAIT)
+        self.assertFalse(both_inside.broken)
+
+    def test_writer_excludes_readers(self):
+        lock = ReadWriteLock()
+        read = Event()
+
+        def reader():
+            with lock.read:
+                read.set()
+
+        with lock.write:
+            thread = _start(reader)
+            self.assertFalse(read.wait(0.2))
+        self.assertTrue(read.wait(WAIT))
+        thread.join(WAIT)
+
+    def test_writer_waits_for_readers(self):
+        lock = ReadWriteLock()
+        written = Event()
+
+        def writer():
+            with lock.write:
+                written.set()
+
+        with lock.read:
+            thread = _start(writer)
+            self.assertFalse(written.wait(0.2))
+        self.assertTrue(written.wait(WAIT))
+        thread.join(WAIT)
+
+    def test_waiting_writer_holds_back_new_readers(self):
+        lock = ReadWriteLock()
+        order = []
+        lock.acquire_read()
+
+        def writer():
+            with lock.write:
+                order.append("writer")
+
+        def reader():
+            with lock.read:
+                order.append("reader")
+
+        writer_thread = _start(writer)
+        while not lock._writers_waiting:  # pylint: disable=protected-access
+            pass
+        reader_thread = _start(reader)
+        self.assertEqual(order, [])
+        lock.release_read()
+        writer_thread.join(WAIT)
+        reader_thread.join(WAIT)
+        self.assertEqual(order, ["writer", "reader"])
+
+
+class ExclusiveLockTests(unittest.TestCase):
+    """ExclusiveLock semantics"""
+
+    def test_read_and_write_are_the_same_lock(self):
+        lock = ExclusiveLock()
+        with lock.read:
+            self.assertFalse(lock.write.acquire(blocking=False))
+
+
+if __name__ == "__main__":
+    unittest.main()
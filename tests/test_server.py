@@ -0,0 +1,186 @@
+"""Tests for the JSON HTTP request handler"""
+from http.client import HTTPConnection
+from http.server import HTTPServer, ThreadingHTTPServer
+from threading import Thread
+import io
+import json
+import socket
+import unittest
+
+from mock_rest_server.__main__ import ThreadPoolHTTPServer
+from mock_rest_server.database import JsonDatabase
+from mock_rest_server import server
+from mock_rest_server.server import BODY_BUFFER_SIZE, JsonHttpRequestHandler
+
+WAIT = 5
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+class ServerTestCase(unittest.TestCase):
+    """Serves a fresh database from a handler subclass for each test"""
+
+    server_type: type[HTTPServer] = ThreadingHTTPServer
+    handler_options: dict = {}
+
+    def setUp(self):
+        handler = type("Handler", (JsonHttpRequestHandler,), {"timeout": WAIT})
+        handler.configure(database=JsonDatabase(), **self.handler_options)
+        self.server = self.server_type(("127.0.0.1", 0), handler)
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        # cleanups run last-in first-out, so client connections close first
+        self.addCleanup(self.stop_server)
+
+    def stop_server(self):
+        """Stop serving, and wait for the handler threads to finish"""
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join(WAIT)
+
+    def connect(self) -> HTTPConnection:
+        """Open a client connection to the server"""
+        host, port = self.server.server_address[:2]
+        connection = HTTPConnection(host, port, timeout=WAIT)
+        self.addCleanup(connection.close)
+        return connection
+
+    def send_raw(self, request: bytes) -> bytes:
+        """Send a raw request, returning everything received until closed"""
+        with socket.create_connection(self.server.server_address[:2], WAIT) as sock:
+            sock.sendall(request)
+            sock.shutdown(socket.SHUT_WR)
+            received = b""
+            while chunk := sock.recv(65536):
+                received += chunk
+            return received
+
+
+class KeepAliveTests(ServerTestCase):
+    """HTTP/1.1 connection reuse"""
+
+    def test_connection_is_reused_across_requests(self):
+        connection = self.connect()
+        connection.request("POST", "/things", json.dumps({"id": "1"}), JSON_HEADERS)
+        response = connection.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader("Connection"), "keep-alive")
+        response.read()
+        sock = connection.sock
+
+        connection.request("GET", "/things")
+        response = connection.getresponse()
+        self.assertEqual(json.loads(response.read()), [{"id": "1"}])
+        self.assertIs(connection.sock, sock)
+
+    def test_unread_body_closes_the_connection(self):
+        connection = self.connect()
+        connection.request("POST", "/things", "{}", {"Content-Type": "text/plain"})
+        response = connection.getresponse()
+        self.assertEqual(response.status, 400)
+        self.assertEqual(response.getheader("Connection"), "close")
+
+    def test_empty_body_keeps_the_connection(self):
+        connection = self.connect()
+        connection.request("GET", "/things", headers={"Content-Length": "0"})
+        response = connection.getresponse()
+        self.assertEqual(response.getheader("Connection"), "keep-alive")
+
+    def test_unsupported_method(self):
+        connection = self.connect()
+        connection.request("OPTIONS", "/things")
+        self.assertEqual(connection.getresponse().status, 501)
+
+    def test_head_response_has_no_body(self):
+        sock = socket.create_connection(self.server.server_address[:2], WAIT)
+        self.addCleanup(sock.close)
+        sock.sendall(b"HEAD /things HTTP/1.1\r\n\r\nGET /things HTTP/1.1\r\n\r\n")
+        responses = sock.makefile("rb")
+        self.addCleanup(responses.close)
+        head = []
+        while (line := responses.readline()) != b"\r\n":
+            head.append(line)
+        self.assertIn(b"501", head[0])
+        self.assertTrue(any(line.startswith(b"Content-Length: ") for line in head))
+        # the next thing on the connection is the response to the GET
+        self.assertTrue(responses.readline().startswith(b"HTTP/1.1 404 "))
+
+
+class ThreadPoolTests(KeepAliveTests):
+    """The same behaviour from the bounded thread pool server"""
+
+    server_type = ThreadPoolHTTPServer
+
+
+class SingleThreadedTests(ServerTestCase):
+    """Without keep-alive, one client can't hold up the others"""
+
+    server_type = HTTPServer
+    handler_options = {"keep_alive": False}
+
+    def test_connections_are_closed(self):
+        connection = self.connect()
+        connection.request("GET", "/")
+        response = connection.getresponse()
+        self.assertEqual(response.getheader("Connection"), "close")
+
+
+class ContentLengthTests(ServerTestCase):
+    """Reading request bodies"""
+
+    def post(self, body: bytes, content_length: str | None) -> tuple[int, dict]:
+        """POST a body with the given Content-Length header"""
+        headers = b"Content-Type: application/json\r\n"
+        if content_length is not None:
+            headers += b"Content-Length: %s\r\n" % content_length.encode()
+        response = self.send_raw(
+            b"POST /things HTTP/1.1\r\nConnection: close\r\n%s\r\n%s" % (headers, body)
+        )
+        head, _, payload = response.partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(payload)
+
+    def test_negative_content_length_is_rejected(self):
+        self.assertEqual(self.post(b'{"id": "1"}', "11")[0], 200)
+        status, payload = self.post(b"", "-1")
+        self.assertEqual(status, 400)
+        self.assertIn("Content-Length", payload["error"])
+
+    def test_previous_body_is_not_reused(self):
+        self.assertEqual(self.post(b'{"id": "1"}', "11")[0], 200)
+        status, payload = self.post(b"", None)
+        self.assertEqual(status, 400)
+        self.assertNotIn("Duplicate", payload["error"])
+
+    def test_invalid_content_length_is_rejected(self):
+        self.assertEqual(self.post(b"{}", "two")[0], 400)
+
+    def test_large_body(self):
+        body = json.dumps({"id": "1", "name": "a" * 200_000}).encode()
+        self.assertEqual(self.post(body, str(len(body)))[0], 200)
+        status, payload = self.post(body, str(len(body) + 1))
+        self.assertEqual(status, 400)
+        self.assertIn("shorter", payload["error"])
+
+    def test_large_body_does_not_grow_the_buffer(self):
+        handler = JsonHttpRequestHandler.__new__(JsonHttpRequestHandler)
+        for size in (10, BODY_BUFFER_SIZE * 3 + 1, 20):
+            handler.rfile = io.BytesIO(b"x" * size)
+            body = handler._read_body_bytes(size)  # pylint: disable=protected-access
+            self.assertEqual(bytes(body), b"x" * size)
+            buffer = server._body_buffers.buffer  # pylint: disable=protected-access
+            self.assertEqual(len(buffer), BODY_BUFFER_SIZE)
+
+
+class LoggingTests(ServerTestCase):
+    """Request logging"""
+
+    def test_control_characters_are_escaped(self):
+        with self.assertLogs("mock_rest_server.server", "INFO") as logs:
+            self.send_raw(b"GET /\x1b[31m HTTP/1.1\r\nConnection: close\r\n\r\n")
+        self.assertTrue(logs.output)
+        for line in logs.output:
+            self.assertNotIn("\x1b", line)
+        self.assertIn("\\x1b[31m", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()